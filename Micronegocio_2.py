@@ -1,15 +1,21 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import os
+from micronegocios_common import sniff_separator, codes_to_cat, filter_options, read_parquet_cache, write_parquet_cache
 
 # --- Configuration ---
 CSV_PATH = 'Módulo de emprendimiento.csv' # Make sure this file is in the same directory
 APP_TITLE = "Dashboard: Módulo de Emprendimiento de Micronegocios"
+# Columns offered as sidebar multiselect filters
+FILTER_COLS = ['Creador_Negocio', 'Motivo_Inicio', 'Antiguedad_Negocio_Rango', 'Fuente_Recursos', 'CLASE_TE_Label', 'AREA_Label']
+# Columns plotted as ponderated percentages (Plots 1-4)
+PERCENTAGE_COLS = ['Creador_Negocio', 'Motivo_Inicio', 'Antiguedad_Negocio_Rango', 'Fuente_Recursos']
 
 # --- Helper Function for Data Preparation ---
-@st.cache_data
-def load_and_preprocess_data(csv_file_path):
+def preprocess_csv(csv_file_path):
     """Loads, cleans, and preprocesses the data for the Entrepreneurship dashboard."""
     
     st.write(f"Cargando y preprocesando datos desde: {csv_file_path}")
@@ -17,30 +23,32 @@ def load_and_preprocess_data(csv_file_path):
     df = None
     # Use only the specified columns for this dashboard
     required_cols = ['SECUENCIA_P', 'SECUENCIA_ENCUESTA', 'P3050', 'P3051', 'P639', 'P3052', 'CLASE_TE', 'COD_DEPTO', 'AREA', 'F_EXP', 'DIRECTORIO']
+    # Parse the survey codes straight into compact dtypes (nullable ints keep missing answers as <NA>)
+    dtype_map = {
+        'P3050': 'Int8', 'P3051': 'Int8', 'P639': 'Int8', 'P3052': 'Int8',
+        'CLASE_TE': 'Int8', 'COD_DEPTO': 'Int16', 'AREA': 'category',
+        'F_EXP': 'float32', 'DIRECTORIO': 'int64'
+    }
 
     if not os.path.exists(csv_file_path):
         st.error(f"ERROR: El archivo CSV NO se encontró en la ruta: {csv_file_path}")
         st.stop()
 
+    # Reuse the preprocessed Parquet copy when it is newer than the CSV and the code that built it
+    cached = read_parquet_cache(csv_file_path, __file__)
+    if cached is not None:
+        return cached
+
+    sep = sniff_separator(csv_file_path)
     try:
-        df_temp = pd.read_csv(csv_file_path, encoding='latin-1', sep=',', low_memory=False)
-        found_cols = [col for col in required_cols if col in df_temp.columns]
-        if not found_cols:
-            raise ValueError("Ninguna de las columnas requeridas se encontró con separador ','.")
-        df = df_temp[found_cols].copy()
-        st.write(f"Datos cargados con separador ',' y columnas: {df.columns.tolist()}")
+        # Parse the file once, keeping only the required columns
+        df = pd.read_csv(csv_file_path, encoding='latin-1', sep=sep, usecols=lambda c: c in required_cols, dtype=dtype_map, low_memory=False)
+        if df.columns.empty:
+            raise ValueError(f"Ninguna de las columnas requeridas se encontró con separador '{sep}'.")
+        st.write(f"Datos cargados con separador '{sep}' y columnas: {df.columns.tolist()}")
     except Exception as e:
-        st.warning(f"Error al cargar con separador ',': {e}. Intentando con ';'")
-        try:
-            df_temp = pd.read_csv(csv_file_path, encoding='latin-1', sep=';', low_memory=False)
-            found_cols = [col for col in required_cols if col in df_temp.columns]
-            if not found_cols:
-                raise ValueError("Ninguna de las columnas requeridas se encontró ni con ',' ni con ';'.")
-            df = df_temp[found_cols].copy()
-            st.write(f"Datos cargados con separador ';' y columnas: {df.columns.tolist()}")
-        except Exception as e_fallback:
-            st.error(f"ERROR CRÍTICO: No se pudo cargar el archivo correctamente. Detalle: {e_fallback}")
-            st.stop()
+        st.error(f"ERROR CRÍTICO: No se pudo cargar el archivo correctamente. Detalle: {e}")
+        st.stop()
 
     if df is None or df.empty:
         st.error("ERROR: El DataFrame está vacío o no se pudo cargar.")
@@ -48,7 +56,9 @@ def load_and_preprocess_data(csv_file_path):
 
     # --- Preprocessing for Entrepreneurship Module ---
     if 'DIRECTORIO' in df.columns:
-        df.drop_duplicates(subset=['DIRECTORIO'], keep='first', inplace=True)
+        # Keep the first row of each DIRECTORIO: np.unique returns the first position of every key
+        _, first_positions = np.unique(df['DIRECTORIO'].to_numpy(), return_index=True)
+        df = df.iloc[np.sort(first_positions)]
     
     # P3050: ¿Quién creó o constituyó el negocio o actividad?
     if 'P3050' in df.columns:
@@ -60,8 +70,7 @@ def load_and_preprocess_data(csv_file_path):
             5: 'Un familiar',
             6: 'Otro'
         }
-        df['Creador_Negocio'] = pd.to_numeric(df['P3050'], errors='coerce').map(p3050_map)
-        df['Creador_Negocio'].fillna('Desconocido', inplace=True)
+        df['Creador_Negocio'] = codes_to_cat(df['P3050'], list(p3050_map.values()))
     else: df['Creador_Negocio'] = 'No Disponible'
 
     # P3051: ¿Cuál fue el motivo principal por el que usted inició este negocio o actividad económica?
@@ -75,8 +84,7 @@ def load_and_preprocess_data(csv_file_path):
             6: 'No tenía la experiencia requerida, la escolaridad o capacitación para un empleo',
             7: 'Otro'
         }
-        df['Motivo_Inicio'] = pd.to_numeric(df['P3051'], errors='coerce').map(p3051_map)
-        df['Motivo_Inicio'].fillna('Desconocido', inplace=True)
+        df['Motivo_Inicio'] = codes_to_cat(df['P3051'], list(p3051_map.values()))
     else: df['Motivo_Inicio'] = 'No Disponible'
 
     # P639: ¿Cuánto tiempo lleva funcionado el negocio o actividad?
@@ -88,12 +96,8 @@ def load_and_preprocess_data(csv_file_path):
             4: 'De 5 a menos de 10 años',
             5: '10 años y más'
         }
-        df['Antiguedad_Negocio_Rango'] = pd.to_numeric(df['P639'], errors='coerce').map(p639_map)
-        df['Antiguedad_Negocio_Rango'].fillna('Desconocido', inplace=True)
-        # Define explicit order for categorical plots
-        antiguedad_order = ['Menos de un año', 'De 1 a menos de 3 años', 'De 3 a menos de 5 años', 
-                            'De 5 a menos de 10 años', '10 años y más', 'Desconocido']
-        df['Antiguedad_Negocio_Rango'] = pd.Categorical(df['Antiguedad_Negocio_Rango'], categories=antiguedad_order, ordered=True)
+        # Ordered categories keep the plots in chronological order ('Desconocido' last)
+        df['Antiguedad_Negocio_Rango'] = codes_to_cat(df['P639'], list(p639_map.values()), ordered=True)
     else: df['Antiguedad_Negocio_Rango'] = 'No Disponible'
 
     # P3052: ¿Cuál fue la mayor fuente de recursos para la creación o constitución de este negocio o actividad?
@@ -108,20 +112,18 @@ def load_and_preprocess_data(csv_file_path):
             7: 'No sabe',
             8: 'Otro'
         }
-        df['Fuente_Recursos'] = pd.to_numeric(df['P3052'], errors='coerce').map(p3052_map)
-        df['Fuente_Recursos'].fillna('Desconocido', inplace=True)
+        df['Fuente_Recursos'] = codes_to_cat(df['P3052'], list(p3052_map.values()))
     else: df['Fuente_Recursos'] = 'No Disponible'
     
     # CLASE_TE para Entorno (Urbana/Rural)
     if 'CLASE_TE' in df.columns:
-        df['CLASE_TE_Label'] = pd.to_numeric(df['CLASE_TE'], errors='coerce')
-        df['CLASE_TE_Label'] = df['CLASE_TE_Label'].map({1: 'Urbana', 2: 'Rural'})
-        df['CLASE_TE_Label'].fillna('Desconocido', inplace=True)
+        df['CLASE_TE_Label'] = codes_to_cat(df['CLASE_TE'], ['Urbana', 'Rural'])
     else: df['CLASE_TE_Label'] = 'No Disponible'
 
     # AREA para Ciudades principales y áreas metropolitanas
     if 'AREA' in df.columns:
-        df['AREA_Label'] = df['AREA'].fillna('Desconocida').astype(str)
+        # Stays categorical: only the handful of area codes are strings, each row is an int code
+        df['AREA_Label'] = df['AREA'].cat.add_categories(['Desconocida']).fillna('Desconocida')
         # Map AREA codes to actual city names if possible (example for Colombia)
         # This requires knowing the codes, let's keep it as is for generic AREA for now.
         # If you have a mapping for COD_DEPTO and AREA, you can add it here.
@@ -137,35 +139,140 @@ def load_and_preprocess_data(csv_file_path):
     # Factor de Expansión (F_EXP)
     if 'F_EXP' not in df.columns:
         st.warning("La columna 'F_EXP' no se encontró. Los cálculos de porcentaje no estarán ponderados.")
-        df['F_EXP'] = 1 # Default to 1 if not found
+        df['F_EXP'] = np.float32(1) # Default to 1 if not found
+
+    # Persist the preprocessed frame so the next cold start skips the CSV parser
+    df = df.reset_index(drop=True)
+    write_parquet_cache(df, csv_file_path, st.warning)
 
     return df
 
-# --- Function to Prepare Data for Plotly (for percentages) ---
-def prepare_data_for_plotly_percentage(dataframe, group_col):
-    """Prepares data for Plotly charts, calculating ponderated percentages."""
-    if group_col not in dataframe.columns:
-        st.warning(f"Columna '{group_col}' no encontrada en el DataFrame.")
-        return pd.DataFrame()
+@st.cache_data
+def load_and_preprocess_data(csv_file_path):
+    """Returns the preprocessed data and the sidebar filter options, computed once per cache entry."""
+    df = preprocess_csv(csv_file_path)
+    return df, {col: filter_options(df, col) for col in FILTER_COLS}
 
-    temp_df = dataframe.dropna(subset=[group_col])
-    if temp_df.empty:
+# --- Function to Prepare Data for Plotly (for percentages) ---
+def prepare_data_for_plotly_percentage(f_exp_sums):
+    """Prepares data for Plotly charts from the F_EXP sums of a column, calculating ponderated percentages."""
+    if f_exp_sums.empty:
         return pd.DataFrame()
 
-    df_grouped = temp_df.groupby(group_col)['F_EXP'].sum().reset_index()
+    group_col = f_exp_sums.index.name
+    df_grouped = f_exp_sums.reset_index()
     df_grouped.columns = [group_col, 'F_EXP_Sum']
     
     total_f_exp = df_grouped['F_EXP_Sum'].sum()
     df_grouped['Porcentaje'] = (df_grouped['F_EXP_Sum'] / total_f_exp) * 100 if total_f_exp > 0 else 0
     
     # Ensure proper sorting for ordered categories 
-    if isinstance(df_grouped[group_col].dtype, pd.CategoricalDtype):
+    if isinstance(df_grouped[group_col].dtype, pd.CategoricalDtype) and df_grouped[group_col].cat.ordered:
         df_grouped = df_grouped.sort_values(group_col)
     else:
         df_grouped = df_grouped.sort_values('Porcentaje', ascending=False)
         
     return df_grouped
 
+# --- Function to Build the Filter Mask ---
+def build_filter_mask(dataframe, selections):
+    """Combines the sidebar selections ({column: selected values}) into a single boolean mask."""
+    masks = []
+    for col, selected in selections.items():
+        series = dataframe[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Compare the int8 codes against the codes of the selected labels
+            selected_codes = series.cat.categories.get_indexer(list(selected))
+            masks.append(np.isin(series.cat.codes.to_numpy(), selected_codes[selected_codes >= 0]))
+        else:
+            masks.append(series.isin(selected).to_numpy())
+    # With no active filter a full slice selects every row without building any mask
+    return np.logical_and.reduce(masks) if masks else slice(None)
+
+# --- Function to Sum F_EXP per Label ---
+def weighted_sum_by_code(series, weights):
+    """Sums `weights` for every observed label of `series` with one np.bincount pass over its integer codes."""
+    codes, labels = pd.factorize(series)
+    # Missing labels and missing weights are left out, like groupby().sum() (np.bincount would propagate NaN)
+    valid = (codes >= 0) & ~np.isnan(weights)
+    sums = np.bincount(codes[valid], weights=weights[valid], minlength=len(labels))
+    return pd.Series(sums, index=pd.Index(labels, name=series.name))
+
+# --- Function to Cross Two Columns ---
+def weighted_crosstab(index, columns, weights):
+    """Sums the weights for every (index, columns) label pair and returns the wide table (one column per trace)."""
+    # Empty combinations stay NaN, which Plotly draws as no bar (like groupby(observed=True))
+    return pd.crosstab(index, columns, values=weights, aggfunc='sum')
+
+# --- Function to Build a Stacked Bar Chart ---
+def stacked_bar_figure(ct, title, x_title, color_title, height):
+    """Builds a stacked bar chart with one go.Bar per column of a weighted crosstab.
+
+    Every trace gets plain NumPy arrays, so Plotly serializes each one in a single pass
+    instead of splitting a long-form DataFrame per color group like px.bar does.
+    """
+    x = ct.index.to_numpy()
+    traces = [
+        go.Bar(
+            x=x,
+            y=ct[col].to_numpy(),
+            name=str(col),
+            hovertemplate=f"{x_title}=%{{x}}<br>Casos Ponderados=%{{y}}<extra>{col}</extra>"
+        )
+        for col in ct.columns
+    ]
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        title=title,
+        barmode='stack',
+        height=height,
+        xaxis_title=x_title,
+        yaxis_title='Casos Ponderados',
+        legend_title_text=color_title
+    )
+    fig.update_yaxes(rangemode="tozero")
+    return fig
+
+# --- Function to Compute the Plot Aggregations ---
+@st.cache_data
+def compute_aggregations(filters, _df):
+    """Applies the filters and computes the data for every plot, cached per filter combination.
+
+    `filters` is a tuple of (column, tuple of selected values) pairs. The leading underscore
+    in `_df` tells Streamlit not to hash the (already cached) base DataFrame.
+    """
+    # Keep only the boolean mask: each plot slices just the columns it needs instead of
+    # materializing a filtered copy of the whole frame
+    mask = build_filter_mask(_df, dict(filters))
+    aggregations = {'n_registros': len(_df) if isinstance(mask, slice) else int(mask.sum())}
+    if aggregations['n_registros'] == 0:
+        return aggregations
+
+    weights = _df['F_EXP'].to_numpy()[mask]
+    for col in PERCENTAGE_COLS:
+        aggregations[col] = prepare_data_for_plotly_percentage(weighted_sum_by_code(_df[col][mask], weights))
+
+    motivo = _df['Motivo_Inicio'][mask]
+
+    # Plot 5: Antigüedad x Motivo de Inicio
+    aggregations['Antiguedad_Motivo'] = weighted_crosstab(_df['Antiguedad_Negocio_Rango'][mask], motivo, weights)
+
+    # Plot 6: Creador x Entorno
+    aggregations['Clase_TE_Creador'] = weighted_crosstab(_df['CLASE_TE_Label'][mask], _df['Creador_Negocio'][mask], weights)
+
+    # Plot 7: Motivo de Inicio x Top 10 Areas by number of businesses for readability
+    area = _df['AREA_Label'][mask]
+    area_codes, areas = pd.factorize(area)
+    # Missing weights count as 0, like groupby().sum(): a NaN sum would rank its area out of the top 10
+    area_sums = np.bincount(area_codes, weights=np.where(np.isnan(weights), 0, weights), minlength=len(areas))
+    # argpartition selects the 10 largest sums without sorting every area
+    top_k = min(10, len(areas))
+    top_area_codes = np.argpartition(-area_sums, top_k - 1)[:top_k]
+    in_top_areas = np.isin(area_codes, top_area_codes)
+    aggregations['Area_Motivo'] = weighted_crosstab(area[in_top_areas], motivo[in_top_areas], weights[in_top_areas])
+
+    return aggregations
+
 # --- Streamlit App Layout ---
 st.set_page_config(
     page_title=APP_TITLE,
@@ -177,7 +284,7 @@ st.title(APP_TITLE)
 st.markdown("Este dashboard se enfoca en el *Módulo de Emprendimiento*, analizando cómo se inician y desarrollan los micronegocios.")
 
 # Load data once
-df = load_and_preprocess_data(CSV_PATH)
+df, opts = load_and_preprocess_data(CSV_PATH)
 
 # Check if data loading was successful
 if df.empty:
@@ -187,42 +294,42 @@ if df.empty:
 # --- Sidebar Filters ---
 st.sidebar.header("Filtros del Dashboard")
 
-unique_creador = df['Creador_Negocio'].unique().tolist()
+unique_creador = opts['Creador_Negocio']
 selected_creador = st.sidebar.multiselect(
     "Filtrar por Creador del Negocio",
     options=unique_creador,
     default=unique_creador
 )
 
-unique_motivo = df['Motivo_Inicio'].unique().tolist()
+unique_motivo = opts['Motivo_Inicio']
 selected_motivo = st.sidebar.multiselect(
     "Filtrar por Motivo de Inicio",
     options=unique_motivo,
     default=unique_motivo
 )
 
-unique_antiguedad_rango = df['Antiguedad_Negocio_Rango'].unique().tolist()
+unique_antiguedad_rango = opts['Antiguedad_Negocio_Rango']
 selected_antiguedad_rango = st.sidebar.multiselect(
     "Filtrar por Rango de Antigüedad",
     options=unique_antiguedad_rango,
     default=unique_antiguedad_rango
 )
 
-unique_fuente_recursos = df['Fuente_Recursos'].unique().tolist()
+unique_fuente_recursos = opts['Fuente_Recursos']
 selected_fuente_recursos = st.sidebar.multiselect(
     "Filtrar por Fuente de Recursos",
     options=unique_fuente_recursos,
     default=unique_fuente_recursos
 )
 
-unique_clase_te = df['CLASE_TE_Label'].unique().tolist()
+unique_clase_te = opts['CLASE_TE_Label']
 selected_clase_te = st.sidebar.multiselect(
     "Filtrar por Entorno (Urbana/Rural)",
     options=unique_clase_te,
     default=unique_clase_te
 )
 
-unique_area = df['AREA_Label'].unique().tolist()
+unique_area = opts['AREA_Label']
 selected_area = st.sidebar.multiselect(
     "Filtrar por Área Metropolitana",
     options=unique_area,
@@ -230,7 +337,7 @@ selected_area = st.sidebar.multiselect(
 )
 
 # You can add a filter for Department if 'COD_DEPTO' is mapped to names
-# unique_deptos = df['Departamento'].unique().tolist()
+# unique_deptos = filter_options(df, 'Departamento')
 # selected_deptos = st.sidebar.multiselect(
 #     "Filtrar por Departamento",
 #     options=unique_deptos,
@@ -238,29 +345,37 @@ selected_area = st.sidebar.multiselect(
 # )
 
 
-# Apply filters
-df_filtered = df[
-    (df['Creador_Negocio'].isin(selected_creador)) &
-    (df['Motivo_Inicio'].isin(selected_motivo)) &
-    (df['Antiguedad_Negocio_Rango'].isin(selected_antiguedad_rango)) &
-    (df['Fuente_Recursos'].isin(selected_fuente_recursos)) &
-    (df['CLASE_TE_Label'].isin(selected_clase_te)) &
-    (df['AREA_Label'].isin(selected_area))
-    # Add (df['Departamento'].isin(selected_deptos)) if you implement department filter
-]
+# Apply filters (sorted tuples so the same selection always hits the same cache entry).
+# Filters left on their default (every option selected) cannot exclude any row and are
+# dropped, so the all-default view shares a single cache entry and does no masking
+selections = (
+    ('Creador_Negocio', selected_creador),
+    ('Motivo_Inicio', selected_motivo),
+    ('Antiguedad_Negocio_Rango', selected_antiguedad_rango),
+    ('Fuente_Recursos', selected_fuente_recursos),
+    ('CLASE_TE_Label', selected_clase_te),
+    ('AREA_Label', selected_area)
+    # Add ('Departamento', selected_deptos) if you implement department filter
+)
+filters = tuple(
+    (col, tuple(sorted(selected)))
+    for col, selected in selections
+    if set(selected) != set(opts[col])
+)
+aggregations = compute_aggregations(filters, df)
 
-if df_filtered.empty:
+if aggregations['n_registros'] == 0:
     st.warning("No hay datos que coincidan con los filtros seleccionados. Ajusta los filtros en la barra lateral.")
     st.stop()
 
 
 # --- Dashboard Sections ---
 st.header("Análisis de las Características del Emprendimiento")
-st.write(f"*Número total de registros (después de filtros):* {len(df_filtered):,}")
+st.write(f"*Número total de registros (después de filtros):* {aggregations['n_registros']:,}")
 
 # --- Plot 1: ¿Quién creó el negocio? (P3050) ---
 st.subheader("1. Origen de la Creación del Negocio")
-df_creador = prepare_data_for_plotly_percentage(df_filtered, 'Creador_Negocio')
+df_creador = aggregations['Creador_Negocio']
 if not df_creador.empty:
     fig_creador = px.bar(
         df_creador,
@@ -280,7 +395,7 @@ st.markdown("---")
 
 # --- Plot 2: Motivo Principal de Inicio (P3051) ---
 st.subheader("2. Motivo Principal para Iniciar el Negocio")
-df_motivo = prepare_data_for_plotly_percentage(df_filtered, 'Motivo_Inicio')
+df_motivo = aggregations['Motivo_Inicio']
 if not df_motivo.empty:
     fig_motivo = px.bar(
         df_motivo,
@@ -300,7 +415,7 @@ st.markdown("---")
 
 # --- Plot 3: Antigüedad del Negocio (P639) ---
 st.subheader("3. Antigüedad del Negocio")
-df_antiguedad_rango = prepare_data_for_plotly_percentage(df_filtered, 'Antiguedad_Negocio_Rango')
+df_antiguedad_rango = aggregations['Antiguedad_Negocio_Rango']
 if not df_antiguedad_rango.empty:
     fig_antiguedad_rango = px.bar(
         df_antiguedad_rango,
@@ -321,7 +436,7 @@ st.markdown("---")
 
 # --- Plot 4: Mayor Fuente de Recursos (P3052) ---
 st.subheader("4. Mayor Fuente de Recursos para la Creación del Negocio")
-df_fuente_recursos = prepare_data_for_plotly_percentage(df_filtered, 'Fuente_Recursos')
+df_fuente_recursos = aggregations['Fuente_Recursos']
 if not df_fuente_recursos.empty:
     fig_fuente_recursos = px.bar(
         df_fuente_recursos,
@@ -342,20 +457,19 @@ st.markdown("---")
 # --- Plot 5: Combinación de Antigüedad y Motivo de Inicio (ejemplo de gráfico cruzado) ---
 st.subheader("5. Relación entre Motivo de Inicio y Antigüedad")
 # Use a smaller subset if this plot becomes too crowded
-df_cross_motive_antiguedad = df_filtered.groupby(['Antiguedad_Negocio_Rango', 'Motivo_Inicio'])['F_EXP'].sum().reset_index()
+df_cross_motive_antiguedad = aggregations['Antiguedad_Motivo']
 if not df_cross_motive_antiguedad.empty:
-    fig_cross_motive_antiguedad = px.bar(
+    fig_cross_motive_antiguedad = stacked_bar_figure(
         df_cross_motive_antiguedad,
-        x='Antiguedad_Negocio_Rango',
-        y='F_EXP',
-        color='Motivo_Inicio',
         title='Motivo de Inicio del Negocio por Rango de Antigüedad (Casos Ponderados)',
-        labels={'Antiguedad_Negocio_Rango': 'Antigüedad del Negocio', 'F_EXP': 'Casos Ponderados', 'Motivo_Inicio': 'Motivo de Inicio'},
-        category_orders={"Antiguedad_Negocio_Rango": df_antiguedad_rango['Antiguedad_Negocio_Rango'].tolist()},
+        x_title='Antigüedad del Negocio',
+        color_title='Motivo de Inicio',
         height=500 # Adjust height for readability
     )
-    fig_cross_motive_antiguedad.update_yaxes(rangemode="tozero")
-    fig_cross_motive_antiguedad.update_layout(barmode='stack')
+    fig_cross_motive_antiguedad.update_xaxes(
+        categoryorder='array',
+        categoryarray=df_antiguedad_rango['Antiguedad_Negocio_Rango'].tolist()
+    )
     st.plotly_chart(fig_cross_motive_antiguedad, use_container_width=True)
 else:
     st.info("No hay datos para mostrar la relación entre Motivo de Inicio y Antigüedad.")
@@ -368,39 +482,29 @@ st.subheader("6. Análisis Geográfico del Emprendimiento")
 col_geo1, col_geo2 = st.columns(2)
 
 with col_geo1:
-    df_creador_clase_te = df_filtered.groupby(['CLASE_TE_Label', 'Creador_Negocio'])['F_EXP'].sum().reset_index()
+    df_creador_clase_te = aggregations['Clase_TE_Creador']
     if not df_creador_clase_te.empty:
-        fig_creador_clase_te = px.bar(
+        fig_creador_clase_te = stacked_bar_figure(
             df_creador_clase_te,
-            x='CLASE_TE_Label',
-            y='F_EXP',
-            color='Creador_Negocio',
             title='Quién Creó el Negocio por Entorno',
-            labels={'CLASE_TE_Label': 'Entorno (Urbana/Rural)', 'F_EXP': 'Casos Ponderados'},
+            x_title='Entorno (Urbana/Rural)',
+            color_title='Creador_Negocio',
             height=400
         )
-        fig_creador_clase_te.update_yaxes(rangemode="tozero")
         st.plotly_chart(fig_creador_clase_te, use_container_width=True)
     else:
         st.info("No hay datos para mostrar quién creó el negocio por entorno.")
 
 with col_geo2:
-    # Top 10 Areas by number of businesses for readability
-    top_areas = df_filtered.groupby('AREA_Label')['F_EXP'].sum().nlargest(10).index.tolist()
-    df_top_areas = df_filtered[df_filtered['AREA_Label'].isin(top_areas)]
-
-    df_motivo_area = df_top_areas.groupby(['AREA_Label', 'Motivo_Inicio'])['F_EXP'].sum().reset_index()
+    df_motivo_area = aggregations['Area_Motivo']
     if not df_motivo_area.empty:
-        fig_motivo_area = px.bar(
+        fig_motivo_area = stacked_bar_figure(
             df_motivo_area,
-            x='AREA_Label',
-            y='F_EXP',
-            color='Motivo_Inicio',
             title='Motivo de Inicio por Top 10 Áreas Metropolitanas',
-            labels={'AREA_Label': 'Área Metropolitana', 'F_EXP': 'Casos Ponderados'},
+            x_title='Área Metropolitana',
+            color_title='Motivo_Inicio',
             height=400
         )
-        fig_motivo_area.update_yaxes(rangemode="tozero")
         fig_motivo_area.update_layout(xaxis={'categoryorder':'total descending'})
         st.plotly_chart(fig_motivo_area, use_container_width=True)
     else:
@@ -1,15 +1,18 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import os
+from micronegocios_common import sniff_separator, filter_options, read_parquet_cache, write_parquet_cache
 
 # --- Configuration ---
 CSV_PATH = 'Módulo de ventas.csv' 
 APP_TITLE = "Dashboard: Módulo de Ventas e Ingresos (Enfocado en Ingresos y Área)"
+# Columns offered as sidebar multiselect filters
+FILTER_COLS = ['AREA_Label']
 
 # --- Helper Function for Data Preparation ---
-@st.cache_data
-def load_and_preprocess_data(csv_file_path):
+def preprocess_csv(csv_file_path):
     """Loads, cleans, and preprocesses the data for the Sales & Income dashboard."""
     
     st.write(f"Cargando y preprocesando datos desde: {csv_file_path}")
@@ -20,30 +23,34 @@ def load_and_preprocess_data(csv_file_path):
         'DIRECTORIO', 'F_EXP', 'AREA', 
         'P3057', 'P3061', 'P3064', 'P3072' 
     ]
+    # Parse each column straight into its final dtype instead of coercing after the load.
+    # float32 halves the memory traffic of the weighted sums (totals are accumulated in float64).
+    # P3072 stays float64: it drives the slider bounds and the range filter, and incomes near 1e9
+    # are not exact in float32 (above 2**24 a value could land on the wrong side of a bound)
+    dtype_map = {
+        'DIRECTORIO': 'int64', 'F_EXP': 'float32', 'AREA': 'category',
+        'P3057': 'float32', 'P3061': 'float32', 'P3064': 'float32', 'P3072': 'float64'
+    }
 
     if not os.path.exists(csv_file_path):
         st.error(f"ERROR: El archivo CSV NO se encontró en la ruta: {csv_file_path}")
         st.stop()
 
+    # Reuse the preprocessed Parquet copy when it is newer than the CSV and the code that built it
+    cached = read_parquet_cache(csv_file_path, __file__)
+    if cached is not None:
+        return cached
+
+    sep = sniff_separator(csv_file_path)
     try:
-        df_temp = pd.read_csv(csv_file_path, encoding='latin-1', sep=',', low_memory=False)
-        found_cols = [col for col in required_cols if col in df_temp.columns]
-        if not found_cols:
-            raise ValueError(f"Ninguna de las columnas requeridas ({', '.join(required_cols)}) se encontró con separador ','.")
-        df = df_temp[found_cols].copy()
+        # Parse the file once, keeping only the required columns
+        df = pd.read_csv(csv_file_path, encoding='latin-1', sep=sep, usecols=lambda c: c in required_cols, dtype=dtype_map, low_memory=False)
+        if df.columns.empty:
+            raise ValueError(f"Ninguna de las columnas requeridas ({', '.join(required_cols)}) se encontró con separador '{sep}'.")
         st.write(f"Columnas encontradas y cargadas: {df.columns.tolist()}")
     except Exception as e:
-        st.warning(f"Error al cargar con separador ',': {e}. Intentando con ';'")
-        try:
-            df_temp = pd.read_csv(csv_file_path, encoding='latin-1', sep=';', low_memory=False)
-            found_cols = [col for col in required_cols if col in df_temp.columns]
-            if not found_cols:
-                raise ValueError(f"Ninguna de las columnas requeridas ({', '.join(required_cols)}) se encontró ni con ',' ni con ';'.")
-            df = df_temp[found_cols].copy()
-            st.write(f"Columnas encontradas y cargadas: {df.columns.tolist()}")
-        except Exception as e_fallback:
-            st.error(f"ERROR CRÍTICO: No se pudo cargar el archivo correctamente. Detalle: {e_fallback}")
-            st.stop()
+        st.error(f"ERROR CRÍTICO: No se pudo cargar el archivo correctamente. Detalle: {e}")
+        st.stop()
 
     if df is None or df.empty:
         st.error("ERROR: El DataFrame está vacío o no se pudo cargar.")
@@ -51,34 +58,52 @@ def load_and_preprocess_data(csv_file_path):
 
     # Drop duplicates based on DIRECTORIO if present
     if 'DIRECTORIO' in df.columns:
-        df.drop_duplicates(subset=['DIRECTORIO'], keep='first', inplace=True)
+        # Keep the first row of each DIRECTORIO: np.unique returns the first position of every key
+        _, first_positions = np.unique(df['DIRECTORIO'].to_numpy(), return_index=True)
+        df = df.iloc[np.sort(first_positions)]
     
     # Ensure F_EXP exists and is numeric
     if 'F_EXP' in df.columns:
-        df['F_EXP'] = pd.to_numeric(df['F_EXP'], errors='coerce').fillna(1)
+        df['F_EXP'] = df['F_EXP'].fillna(1)
     else:
         st.warning("La columna 'F_EXP' no se encontró. Los cálculos no estarán ponderados.")
-        df['F_EXP'] = 1 # Default to 1 if not found
+        df['F_EXP'] = np.float32(1) # Default to 1 if not found
 
     # AREA for Metropolitan Areas
     if 'AREA' in df.columns:
-        df['AREA_Label'] = df['AREA'].fillna('Desconocida').astype(str)
+        # Stays categorical: only the handful of area codes are strings, each row is an int code
+        df['AREA_Label'] = df['AREA'].cat.add_categories(['Desconocida']).fillna('Desconocida')
     else: 
         df['AREA_Label'] = 'No Disponible'
 
-    # Convert income/sales columns to numeric, filling NaNs with 0 for summation
+    # Fill missing income/sales values with 0 for summation
     income_cols_to_process = ['P3057', 'P3061', 'P3064', 'P3072']
     for col in income_cols_to_process:
         if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+            df[col] = df[col].fillna(0)
         else:
-            df[col] = 0 # Ensure column exists if not in original data, set to 0
+            df[col] = np.dtype(dtype_map[col]).type(0) # Ensure column exists if not in original data, set to 0
 
     # Calculate Total Monthly Income from primary sources for composition
     df['Total_Ingresos_Categorizados'] = df['P3057'] + df['P3061'] + df['P3064']
     
+    # Persist the preprocessed frame so the next cold start skips the CSV parser
+    df = df.reset_index(drop=True)
+    write_parquet_cache(df, csv_file_path, st.warning)
+
     return df
 
+@st.cache_data
+def load_and_preprocess_data(csv_file_path):
+    """Returns the preprocessed data and the sidebar filter options, computed once per cache entry."""
+    df = preprocess_csv(csv_file_path)
+    opts = {col: filter_options(df, col) for col in FILTER_COLS}
+    # Slider bounds for P3072 (None when the column has no valid values)
+    has_income = df['P3072'].notna().any()
+    opts['P3072_min'] = float(df['P3072'].min()) if has_income else None
+    opts['P3072_max'] = float(df['P3072'].max()) if has_income else None
+    return df, opts
+
 # --- Streamlit App Layout ---
 st.set_page_config(
     page_title=APP_TITLE,
@@ -90,7 +115,7 @@ st.title(APP_TITLE)
 st.markdown("Este dashboard se enfoca en el *Módulo de Ventas e Ingresos, analizando las fuentes de ingresos y el desempeño económico de los micronegocios, usando **tus datos reales y columnas especificadas*.")
 
 # Load data once
-df = load_and_preprocess_data(CSV_PATH)
+df, opts = load_and_preprocess_data(CSV_PATH)
 
 # Check if data loading was successful
 if df.empty:
@@ -102,8 +127,8 @@ st.sidebar.header("Filtros del Dashboard")
 
 # Filter for P3072 (Average Monthly Income)
 st.sidebar.subheader("Filtrar por Ingreso Promedio Mensual")
-if not df['P3072'].dropna().empty:
-    min_income_p3072, max_income_p3072 = float(df['P3072'].min()), float(df['P3072'].max())
+if opts['P3072_min'] is not None:
+    min_income_p3072, max_income_p3072 = opts['P3072_min'], opts['P3072_max']
     selected_income_p3072_range = st.sidebar.slider(
         "Rango de Ingreso Promedio Mensual ($)",
         min_value=min_income_p3072,
@@ -118,7 +143,7 @@ else:
 
 # Filter for AREA
 st.sidebar.subheader("Filtrar por Área Metropolitana")
-unique_area = df['AREA_Label'].unique().tolist()
+unique_area = opts['AREA_Label']
 selected_area = st.sidebar.multiselect(
     "Selecciona Área(s)",
     options=unique_area,
@@ -126,38 +151,47 @@ selected_area = st.sidebar.multiselect(
 )
 
 # Apply filters
-df_filtered = df[
-    (df['AREA_Label'].isin(selected_area))
-]
-
-# Apply P3072 filter only if valid range is available
-if selected_income_p3072_range[0] != 0 or selected_income_p3072_range[1] != 0:
-     df_filtered = df_filtered[
-        (df_filtered['P3072'] >= selected_income_p3072_range[0]) & (df_filtered['P3072'] <= selected_income_p3072_range[1])
-    ]
-
-
-if df_filtered.empty:
+# (only a boolean mask is kept: each plot slices just the columns it needs instead of
+# materializing a filtered copy of the whole frame. Filters left on their full default
+# cannot exclude any row and are skipped, so the default view does no masking at all)
+masks = []
+if set(selected_area) != set(unique_area):
+    masks.append(df['AREA_Label'].isin(selected_area).to_numpy())
+
+# Apply P3072 filter only if valid range is available and narrower than the full range
+if (selected_income_p3072_range[0] != 0 or selected_income_p3072_range[1] != 0) and \
+        (selected_income_p3072_range[0] > opts['P3072_min'] or selected_income_p3072_range[1] < opts['P3072_max']):
+    p3072_all = df['P3072'].to_numpy()
+    masks.append((p3072_all >= selected_income_p3072_range[0]) & (p3072_all <= selected_income_p3072_range[1]))
+
+filter_mask = np.logical_and.reduce(masks) if masks else slice(None)
+n_registros = len(df) if isinstance(filter_mask, slice) else int(filter_mask.sum())
+if n_registros == 0:
     st.warning("No hay datos que coincidan con los filtros seleccionados. Ajusta los filtros en la barra lateral.")
     st.stop()
 
 
 # --- Dashboard Sections ---
 st.header("Análisis de las Ventas e Ingresos de los Micronegocios")
-st.write(f"*Número total de registros (después de filtros):* {len(df_filtered):,}")
+st.write(f"*Número total de registros (después de filtros):* {n_registros:,}")
+
+# Filtered columns shared by the plots
+f_exp = df['F_EXP'].to_numpy(dtype=np.float64)[filter_mask]
+p3072 = df['P3072'].to_numpy()[filter_mask]
 
 # --- Plot 1: Distribución del Ingreso Promedio Mensual (P3072) ---
 st.subheader("1. Distribución del Ingreso Promedio Mensual (P3072)")
-if df_filtered['P3072'].sum() > 0:
-    fig_p3072_dist = px.histogram(
-        df_filtered,
-        x='P3072',
-        nbins=50,
+if p3072.sum() > 0:
+    # Bin on the server (weighted by F_EXP) so only the 50 bars are sent to the browser
+    counts, edges = np.histogram(p3072, bins=50, weights=f_exp)
+    fig_p3072_dist = px.bar(
+        x=(edges[:-1] + edges[1:]) / 2,
+        y=counts,
         title='Distribución de Micronegocios por Ingreso Promedio Mensual',
-        labels={'P3072': 'Ingreso Promedio Mensual ($)', 'count': 'Número de Negocios'},
-        hover_data={'P3072': '$,.0f'},
+        labels={'x': 'Ingreso Promedio Mensual ($)', 'y': 'Número de Negocios (Ponderado)'},
         log_y=True # Log scale because income data is often skewed
     )
+    fig_p3072_dist.update_traces(width=np.diff(edges), hovertemplate='$%{x:,.0f}: %{y:,.0f}<extra></extra>') # Contiguous bars, like a histogram
     fig_p3072_dist.update_xaxes(tickprefix="$", tickformat=",.0f")
     st.plotly_chart(fig_p3072_dist, use_container_width=True)
 else:
@@ -165,15 +199,9 @@ else:
 
 # --- Plot 2: Composición de Ingresos por Tipo de Venta/Servicio ---
 st.subheader("2. Composición de Ingresos por Tipo de Venta/Servicio")
-# Sum of weighted income types
-df_income_types = df_filtered[['P3057', 'P3061', 'P3064', 'F_EXP']].copy()
-df_income_types['P3057_Weighted'] = df_income_types['P3057'] * df_income_types['F_EXP']
-df_income_types['P3061_Weighted'] = df_income_types['P3061'] * df_income_types['F_EXP']
-df_income_types['P3064_Weighted'] = df_income_types['P3064'] * df_income_types['F_EXP']
-
-total_p3057 = df_income_types['P3057_Weighted'].sum()
-total_p3061 = df_income_types['P3061_Weighted'].sum()
-total_p3064 = df_income_types['P3064_Weighted'].sum()
+# Sum of weighted income types: a single matrix-vector product (income columns x F_EXP)
+income_values = np.column_stack([df[col].to_numpy(dtype=np.float64)[filter_mask] for col in ['P3057', 'P3061', 'P3064']])
+total_p3057, total_p3061, total_p3064 = income_values.T @ f_exp
 
 total_income_weighted_overall = total_p3057 + total_p3061 + total_p3064
 
@@ -199,8 +227,14 @@ else:
 # --- Plot 3: Ingreso Promedio Mensual por Área Metropolitana ---
 st.subheader("3. Ingreso Promedio Mensual por Área Metropolitana (AREA_Label)")
 
-# Calculate average P3072 per Area
-df_income_by_area = df_filtered.groupby('AREA_Label')['P3072'].mean().reset_index()
+# Calculate average P3072 per Area, weighted by F_EXP: two bincount passes over the area codes
+area_codes, areas = pd.factorize(df['AREA_Label'][filter_mask])
+income_sums = np.bincount(area_codes, weights=p3072 * f_exp, minlength=len(areas))
+weight_sums = np.bincount(area_codes, weights=f_exp, minlength=len(areas))
+df_income_by_area = pd.DataFrame({
+    'AREA_Label': np.asarray(areas),
+    'P3072': np.divide(income_sums, weight_sums, out=np.zeros_like(income_sums), where=weight_sums > 0)
+})
 
 if not df_income_by_area.empty and df_income_by_area['P3072'].sum() > 0:
     fig_income_by_area = px.bar(
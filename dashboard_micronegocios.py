@@ -1,65 +1,53 @@
 import streamlit as st
+import csv
+import logging
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
 import os
+from micronegocios_common import sniff_separator, codes_to_cat, filter_options, read_parquet_cache, write_parquet_cache
 
 # --- Configuration ---
 CSV_PATH = 'Módulo de identificación.csv' # Make sure this file is in the same directory
 APP_TITLE = "Dashboard Interactivo de Micronegocios"
+# Loader diagnostics go to the server log instead of being rendered in the page
+logger = logging.getLogger(__name__)
+# Streamlit leaves the root logger at WARNING without a handler, so the script logger gets its own;
+# the guard keeps reruns of the script from stacking a new handler on the same logger
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+# Columns offered as sidebar multiselect filters
+FILTER_COLS = ['Género', 'Industria_Label']
+# Columns plotted as ponderated percentages (Plots 1-7)
+PLOT_COLS = ['Industria_Label', 'Género', 'Edad_Grupo', 'Antiguedad_Negocio_Grupo', 'Tiene_Ayuda', 'AREA_Label', 'CLASE_TE_Label']
+
+# Shared style of the percentage bar charts, stacked on the default template in build_bar
+pio.templates['mn'] = go.layout.Template(
+    data={'bar': [go.Bar(yhoverformat='.2f')]},
+    layout={'showlegend': False, 'yaxis': {'rangemode': 'tozero', 'tickformat': '.2f%'}}
+)
 
 # --- Helper Function for Data Preparation ---
-@st.cache_data # Cache data to avoid reloading on every rerun
-def load_and_preprocess_data(csv_file_path):
-    """Loads, cleans, and preprocesses the data for the dashboard."""
-   
-    st.write(f"Cargando y preprocesando datos desde: {csv_file_path}")
-
-    df = None
-    required_cols = ['P35', 'GRUPOS12', 'P241', 'P3034', 'P3031', 'AREA', 'CLASE_TE', 'F_EXP', 'DIRECTORIO']
-
-    if not os.path.exists(csv_file_path):
-        st.error(f"ERROR: El archivo CSV NO se encontró en la ruta: {csv_file_path}")
-        st.stop() # Stop the app if file is not found
-
-    try:
-        # Try reading with comma separator first
-        df_temp = pd.read_csv(csv_file_path, encoding='latin-1', sep=',', low_memory=False)
-        found_cols = [col for col in required_cols if col in df_temp.columns]
-        if not found_cols:
-            raise ValueError("Ninguna de las columnas requeridas se encontró con separador ','.")
-        df = df_temp[found_cols].copy()
-        st.write(f"Datos cargados con separador ',' y columnas: {df.columns.tolist()}")
-    except Exception as e:
-        st.warning(f"Error al cargar con separador ',': {e}. Intentando con ';'")
-        try:
-            # Fallback to semicolon separator
-            df_temp = pd.read_csv(csv_file_path, encoding='latin-1', sep=';', low_memory=False)
-            found_cols = [col for col in required_cols if col in df_temp.columns]
-            if not found_cols:
-                raise ValueError("Ninguna de las columnas requeridas se encontró ni con ',' ni con ';'.")
-            df = df_temp[found_cols].copy()
-            st.write(f"Datos cargados con separador ';' y columnas: {df.columns.tolist()}")
-        except Exception as e_fallback:
-            st.error(f"ERROR CRÍTICO: No se pudo cargar el archivo correctamente. Detalle: {e_fallback}")
-            st.stop() # Stop the app if data loading fails
-
-    if df is None or df.empty:
-        st.error("ERROR: El DataFrame está vacío o no se pudo cargar.")
-        st.stop()
-
-    # --- Preprocessing ---
-    if 'DIRECTORIO' in df.columns:
-        rows_before_dedup = df.shape[0]
-        df.drop_duplicates(subset=['DIRECTORIO'], keep='first', inplace=True)
-        rows_after_dedup = df.shape[0]
-        if rows_before_dedup > rows_after_dedup:
-            st.info(f"Se eliminaron {rows_before_dedup - rows_after_dedup} filas duplicadas en 'DIRECTORIO'.")
-
+def bins_to_cat(series, edges, labels):
+    """Bins values into left-closed [edges[i], edges[i+1]) intervals as an ordered Categorical; values below the first edge become NaN."""
+    # float32 holds every age/month count exactly and halves the temporary array
+    values = series.to_numpy(dtype='float32')
+    codes = np.searchsorted(np.asarray(edges, dtype='float32'), values, side='right') - 1
+    return pd.Categorical.from_codes(codes.astype('int8'), categories=labels, ordered=True)
+
+def preprocess_chunk(df):
+    """Maps the raw survey codes of one chunk of rows to the dashboard labels and groups."""
     # Mapeo y limpieza de P35 (Sexo del propietario)
     if 'P35' in df.columns:
-        df['Género'] = pd.to_numeric(df['P35'], errors='coerce')
-        df['Género'] = df['Género'].map({1: 'Hombre', 2: 'Mujer'})
-        df['Género'].fillna('Desconocido', inplace=True)
+        df['Género'] = codes_to_cat(df['P35'], ['Hombre', 'Mujer'])
     else: df['Género'] = 'No Disponible'
 
     # Mapeo y limpieza de GRUPOS12 (Rama de actividad)
@@ -73,87 +61,276 @@ def load_and_preprocess_data(csv_file_path):
             11: 'Administración Pública y Defensa; Educación; Servicios Sociales y de Salud',
             12: 'Otras Actividades de Servicios Comunitarias, Sociales y Personales'
         }
-        df['Industria_Label'] = pd.to_numeric(df['GRUPOS12'], errors='coerce')
-        df['Industria_Label'] = df['Industria_Label'].map(grupos12_map)
-        df['Industria_Label'].fillna('Desconocido', inplace=True)
+        df['Industria_Label'] = codes_to_cat(df['GRUPOS12'], list(grupos12_map.values()))
     else: df['Industria_Label'] = 'No Disponible'
 
     # Edad del propietario (P241) y creación de grupos de edad
     if 'P241' in df.columns:
-        df['Edad'] = pd.to_numeric(df['P241'], errors='coerce')
+        df['Edad'] = df['P241']
         df.dropna(subset=['Edad'], inplace=True)
-        bins_edad = [0, 25, 35, 45, 55, 65, df['Edad'].max() + 10 if df['Edad'].max() > 0 else 100]
+        # Open-ended top bin: no extra pass over the column to find its maximum
+        bins_edad = np.array([0, 25, 35, 45, 55, 65, np.inf])
         labels_edad = ['<25', '25-34', '35-44', '45-54', '55-64', '65+']
-        df['Edad_Grupo'] = pd.cut(df['Edad'], bins=bins_edad, labels=labels_edad, right=False, include_lowest=True)
-        # Ensure categories are explicitly set for correct ordering in plots
-        df['Edad_Grupo'] = pd.Categorical(df['Edad_Grupo'], categories=labels_edad, ordered=True)
+        df['Edad_Grupo'] = bins_to_cat(df['Edad'], bins_edad, labels_edad)
     else:
         df['Edad'] = None
         df['Edad_Grupo'] = 'No Disponible'
 
     # Meses de operación del negocio (P3034) y creación de grupos de antigüedad
     if 'P3034' in df.columns:
-        df['Antiguedad_Meses'] = pd.to_numeric(df['P3034'], errors='coerce')
+        df['Antiguedad_Meses'] = df['P3034']
         df.dropna(subset=['Antiguedad_Meses'], inplace=True)
-        bins_antiguedad = [0, 12, 36, 60, 120, 240, df['Antiguedad_Meses'].max() + 10 if df['Antiguedad_Meses'].max() > 0 else 250]
+        bins_antiguedad = np.array([0, 12, 36, 60, 120, 240, np.inf])
         labels_antiguedad = ['<1 año', '1-3 años', '3-5 años', '5-10 años', '10-20 años', '20+ años']
-        df['Antiguedad_Negocio_Grupo'] = pd.cut(df['Antiguedad_Meses'], bins=bins_antiguedad, labels=labels_antiguedad, right=False, include_lowest=True)
-        # Ensure categories are explicitly set for correct ordering in plots
-        df['Antiguedad_Negocio_Grupo'] = pd.Categorical(df['Antiguedad_Negocio_Grupo'], categories=labels_antiguedad, ordered=True)
+        df['Antiguedad_Negocio_Grupo'] = bins_to_cat(df['Antiguedad_Meses'], bins_antiguedad, labels_antiguedad)
     else:
         df['Antiguedad_Meses'] = None
         df['Antiguedad_Negocio_Grupo'] = 'No Disponible'
 
     # P3031 (Tiene ayuda)
     if 'P3031' in df.columns:
-        df['Tiene_Ayuda'] = pd.to_numeric(df['P3031'], errors='coerce')
-        df['Tiene_Ayuda'] = df['Tiene_Ayuda'].map({1: 'Sí', 2: 'No'})
-        df['Tiene_Ayuda'].fillna('Desconocido', inplace=True)
+        df['Tiene_Ayuda'] = codes_to_cat(df['P3031'], ['Sí', 'No'])
     else: df['Tiene_Ayuda'] = 'No Disponible'
 
     # AREA y CLASE_TE para Ubicación
     if 'AREA' in df.columns:
-        df['AREA_Label'] = df['AREA'].fillna('Desconocida').astype(str)
+        # Kept as a Categorical: the few distinct area strings are stored once, rows hold int codes
+        df['AREA_Label'] = df['AREA'].cat.add_categories(['Desconocida']).fillna('Desconocida')
     else: df['AREA_Label'] = 'No Disponible'
 
     if 'CLASE_TE' in df.columns:
-        df['CLASE_TE_Label'] = pd.to_numeric(df['CLASE_TE'], errors='coerce')
-        df['CLASE_TE_Label'] = df['CLASE_TE_Label'].map({1: 'Urbana', 2: 'Rural'})
-        df['CLASE_TE_Label'].fillna('Desconocido', inplace=True)
+        df['CLASE_TE_Label'] = codes_to_cat(df['CLASE_TE'], ['Urbana', 'Rural'])
     else: df['CLASE_TE_Label'] = 'No Disponible'
 
+    return df
+
+def concat_chunks(chunks):
+    """Concatenates preprocessed chunks, unifying categories that differ between chunks (e.g. AREA)."""
+    for col in chunks[0].columns:
+        dtype = chunks[0][col].dtype
+        if isinstance(dtype, pd.CategoricalDtype) and any(chunk[col].dtype != dtype for chunk in chunks[1:]):
+            categories = dtype.categories
+            for chunk in chunks[1:]:
+                categories = categories.union(chunk[col].cat.categories)
+            for i, chunk in enumerate(chunks):
+                chunks[i] = chunk.assign(**{col: chunk[col].cat.set_categories(categories)})
+    return pd.concat(chunks, ignore_index=True)
+
+def preprocess_csv(csv_file_path):
+    """Loads, cleans, and preprocesses the data for the dashboard."""
+   
+    logger.info("Cargando y preprocesando datos desde: %s", csv_file_path)
+
+    required_cols = ['P35', 'GRUPOS12', 'P241', 'P3034', 'P3031', 'AREA', 'CLASE_TE', 'F_EXP', 'DIRECTORIO']
+    # Parse the survey codes straight into compact Arrow types (nullable ints keep missing answers as <NA>)
+    column_types = {
+        'P35': pa.int8(), 'GRUPOS12': pa.int8(), 'P3031': pa.int8(), 'CLASE_TE': pa.int8(),
+        'P241': pa.int16(), 'P3034': pa.int32(), 'AREA': pa.dictionary(pa.int32(), pa.string()),
+        'F_EXP': pa.float32(), 'DIRECTORIO': pa.int64()
+    }
+    # Arrow integer columns become pandas nullable ints instead of float64 when they hold nulls
+    nullable_ints = {pa.int8(): pd.Int8Dtype(), pa.int16(): pd.Int16Dtype(), pa.int32(): pd.Int32Dtype()}
+
+    if not os.path.exists(csv_file_path):
+        st.error(f"ERROR: El archivo CSV NO se encontró en la ruta: {csv_file_path}")
+        st.stop() # Stop the app if file is not found
+
+    # Reuse the preprocessed Parquet copy when it is newer than the CSV and the code that built it
+    cached = read_parquet_cache(csv_file_path, __file__)
+    if cached is not None:
+        return cached
+
+    sep = sniff_separator(csv_file_path)
+    chunks = []
+    seen_directorios = np.empty(0, dtype='int64')
+    n_rows = n_duplicated = 0
+    try:
+        with open(csv_file_path, encoding='latin-1', newline='') as f:
+            found_cols = [col for col in next(csv.reader(f, delimiter=sep)) if col in required_cols]
+        if not found_cols:
+            raise ValueError(f"Ninguna de las columnas requeridas se encontró con separador '{sep}'.")
+        # Stream the file in 8 MB blocks with the Arrow reader, keeping only the required columns:
+        # only one raw block is held at a time, next to the compact preprocessed chunks
+        reader = pacsv.open_csv(
+            csv_file_path,
+            read_options=pacsv.ReadOptions(encoding='latin-1', use_threads=True, block_size=8 << 20),
+            parse_options=pacsv.ParseOptions(delimiter=sep),
+            convert_options=pacsv.ConvertOptions(
+                include_columns=found_cols,
+                column_types={col: column_types[col] for col in found_cols},
+                strings_can_be_null=True
+            )
+        )
+        for batch in reader:
+            n_rows += batch.num_rows
+            chunk = batch.to_pandas(types_mapper=nullable_ints.get)
+            if 'DIRECTORIO' in chunk.columns:
+                # Keep the first row of each DIRECTORIO across the whole file: drop the repeats
+                # inside the chunk and the keys already kept from earlier chunks
+                duplicated = chunk['DIRECTORIO'].duplicated(keep='first').to_numpy(copy=True)
+                keys = chunk['DIRECTORIO'].to_numpy()[~duplicated]
+                # Binary search in the sorted kept keys: only the chunk's keys are sorted, never the kept ones
+                positions = np.searchsorted(seen_directorios, keys)
+                already_seen = seen_directorios[np.minimum(positions, seen_directorios.size - 1)] == keys if seen_directorios.size else np.zeros(keys.size, dtype=bool)
+                duplicated[~duplicated] = already_seen
+                if duplicated.any():
+                    n_duplicated += int(duplicated.sum())
+                    chunk = chunk[~duplicated]
+                # Merge the new keys in place of a full re-sort: one linear copy per chunk
+                new_keys = np.sort(keys[~already_seen])
+                seen_directorios = np.insert(seen_directorios, np.searchsorted(seen_directorios, new_keys), new_keys)
+            chunks.append(preprocess_chunk(chunk))
+        logger.info("Datos cargados con separador '%s' y columnas: %s", sep, found_cols)
+    except Exception as e:
+        st.error(f"ERROR CRÍTICO: No se pudo cargar el archivo correctamente. Detalle: {e}")
+        st.stop() # Stop the app if data loading fails
+
+    if n_rows == 0:
+        st.error("ERROR: El DataFrame está vacío o no se pudo cargar.")
+        st.stop()
+
+    if n_duplicated:
+        logger.info("Se eliminaron %d filas duplicadas en 'DIRECTORIO'.", n_duplicated)
+
+    df = concat_chunks(chunks)
+
     # Factor de Expansión (F_EXP)
     if 'F_EXP' not in df.columns:
-        st.warning("La columna 'F_EXP' no se encontró. Los cálculos de porcentaje no estarán ponderados.")
-        df['F_EXP'] = 1 # Default to 1 if not found
+        logger.warning("La columna 'F_EXP' no se encontró. Los cálculos de porcentaje no estarán ponderados.")
+        df['F_EXP'] = np.float32(1) # Default to 1 if not found
+
+    # Persist the preprocessed frame so the next cold start skips the CSV parser
+    write_parquet_cache(df, csv_file_path, logger.warning)
 
     return df
 
+# Shared singleton: reruns get the same frame without the per-access copy of st.cache_data,
+# so the app must treat it as read-only (filtering indexes the code arrays, nothing mutates df)
+@st.cache_resource(show_spinner='Cargando datos...')
+def load_and_preprocess_data(csv_file_path):
+    """Returns the preprocessed data and the sidebar filter options, computed once per cache entry."""
+    df = preprocess_csv(csv_file_path)
+    return df, {col: filter_options(df, col) for col in FILTER_COLS}
+
 # --- Function to Prepare Data for Plotly ---
-def prepare_data_for_plotly(dataframe, group_col):
-    """Prepares data for Plotly charts, calculating ponderated percentages."""
-    if group_col not in dataframe.columns:
-        st.warning(f"Columna '{group_col}' no encontrada en el DataFrame.")
-        return pd.DataFrame() # Return empty DataFrame
-
-    temp_df = dataframe.dropna(subset=[group_col])
-    if temp_df.empty:
+def prepare_data_for_plotly(f_exp_sums):
+    """Prepares data for Plotly charts from the F_EXP sums of a column, calculating ponderated percentages."""
+    if f_exp_sums.empty:
         return pd.DataFrame()
 
-    df_grouped = temp_df.groupby(group_col)['F_EXP'].sum().reset_index()
+    group_col = f_exp_sums.index.name
+    df_grouped = f_exp_sums.reset_index()
     df_grouped.columns = [group_col, 'F_EXP_Sum']
 
-    total_f_exp = df_grouped['F_EXP_Sum'].sum()
-    df_grouped['Porcentaje'] = (df_grouped['F_EXP_Sum'] / total_f_exp) * 100 if total_f_exp > 0 else 0
-   
-    # Ensure proper sorting for ordered categories like age/antiquity
-    if isinstance(df_grouped[group_col].dtype, pd.CategoricalDtype):
+    f_exp_sum = df_grouped['F_EXP_Sum'].to_numpy()
+    total_f_exp = f_exp_sum.sum()
+    # One fused scale on the array instead of a Series divide plus a Series multiply
+    df_grouped['Porcentaje'] = np.multiply(f_exp_sum, 100.0 / total_f_exp if total_f_exp > 0 else 0.0, dtype=np.float32)
+
+    # Ensure proper sorting for ordered categories like age/antiquity (Plotly keeps the row order on the x axis)
+    if isinstance(df_grouped[group_col].dtype, pd.CategoricalDtype) and df_grouped[group_col].cat.ordered:
         df_grouped = df_grouped.sort_values(group_col)
     else:
         df_grouped = df_grouped.sort_values('Porcentaje', ascending=False)
        
     return df_grouped
 
+# --- Function to Build a Percentage Bar Chart ---
+@st.cache_data(show_spinner=False)
+def build_bar(summary_df, x, title, x_label, y_label, categoryorder=None):
+    """Builds the percentage bar chart of an aggregated frame, cached per frame and labels.
+
+    The columns go to px.bar as NumPy arrays, so Plotly does not copy and re-validate
+    a DataFrame per chart.
+    """
+    fig = px.bar(
+        x=summary_df[x].to_numpy(),
+        y=summary_df['Porcentaje'].to_numpy(),
+        title=title,
+        labels={'x': x_label, 'y': y_label},
+        hover_data={'F_EXP_Sum': (True, summary_df['F_EXP_Sum'].to_numpy())}, # Show weighted count and percentage on hover
+        template=f"{pio.templates.default}+mn"
+    )
+    if categoryorder:
+        fig.update_layout(xaxis={'categoryorder': categoryorder})
+    return fig
+
+# --- Function to Split the Frame into Code Arrays ---
+@st.cache_resource(show_spinner=False)
+def load_code_arrays(csv_file_path):
+    """Returns the columns the dashboard filters and plots as flat NumPy arrays.
+
+    `arrays` maps 'F_EXP' to the weights and every label column to its int category codes;
+    `dtypes` keeps the CategoricalDtype of each label column to turn codes back into labels.
+    """
+    df, _ = load_and_preprocess_data(csv_file_path)
+    # float64 once per load: np.bincount would otherwise convert float32 weights on every call.
+    # Missing weights become 0: np.bincount propagates NaN, where groupby().sum() skipped it
+    arrays = {'F_EXP': df['F_EXP'].to_numpy(dtype=np.float64, na_value=0.0)}
+    dtypes = {}
+    for col in dict.fromkeys(FILTER_COLS + PLOT_COLS):
+        if col not in df.columns:
+            continue
+        series = df[col]
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype('category') # 'No Disponible' placeholder columns
+        arrays[col] = series.cat.codes.to_numpy()
+        dtypes[col] = series.dtype
+    return arrays, dtypes
+
+# --- Function to Build the Filter Mask ---
+def build_filter_mask(arrays, dtypes, selections):
+    """Combines the sidebar selections ({column: selected values}) into a single boolean mask."""
+    masks = []
+    for col, selected in selections.items():
+        # Compare the int codes against the codes of the selected labels
+        selected_codes = dtypes[col].categories.get_indexer(list(selected))
+        masks.append(np.isin(arrays[col], selected_codes[selected_codes >= 0]))
+    return np.logical_and.reduce(masks)
+
+# --- Function to Sum F_EXP per Label ---
+def weighted_sum_by_code(codes, dtype, weights, name):
+    """Sums `weights` for every observed category of a label column with np.bincount over its int codes."""
+    if codes.min(initial=0) < 0:
+        # Missing labels (code -1) are left out, like groupby's dropna
+        valid = codes >= 0
+        codes, weights = codes[valid], weights[valid]
+    n_categories = len(dtype.categories)
+    sums = np.bincount(codes, weights=weights, minlength=n_categories)
+    # Keep only the categories that have rows, like groupby(observed=True)
+    observed = np.flatnonzero(np.bincount(codes, minlength=n_categories))
+    index = pd.CategoricalIndex(pd.Categorical.from_codes(observed, dtype=dtype), name=name)
+    return pd.Series(sums[observed], index=index)
+
+# --- Function to Compute the Plot Aggregations ---
+@st.cache_data(show_spinner=False)
+def compute_aggregations(genders_key, industries_key, _arrays, _dtypes):
+    """Filters the code arrays and computes the data for every plot together, cached per filter selection.
+
+    `genders_key` and `industries_key` are the sorted filter selections; on a cache hit no per-row
+    work is done. The leading underscores tell Streamlit not to hash the unfiltered arrays.
+    Returns the number of filtered rows and the aggregations of every plot.
+    """
+    filter_mask = build_filter_mask(_arrays, _dtypes, {
+        'Género': genders_key,
+        'Industria_Label': industries_key
+    })
+    # Only the code and weight arrays are sliced; no filtered DataFrame is built
+    filtered_idx = np.flatnonzero(filter_mask)
+    if filtered_idx.size == 0:
+        return 0, {}
+    filtered = {col: values[filtered_idx] for col, values in _arrays.items()}
+
+    weights = filtered['F_EXP']
+    aggregations = {}
+    for col in PLOT_COLS:
+        if col not in filtered:
+            st.warning(f"Columna '{col}' no encontrada en el DataFrame.")
+            aggregations[col] = pd.DataFrame()
+            continue
+        aggregations[col] = prepare_data_for_plotly(weighted_sum_by_code(filtered[col], _dtypes[col], weights, col))
+    return filtered_idx.size, aggregations
+
 # --- Streamlit App Layout ---
 st.set_page_config(
     page_title=APP_TITLE,
@@ -164,18 +341,21 @@ st.set_page_config(
 st.title(APP_TITLE)
 
 # Load data once
-df = load_and_preprocess_data(CSV_PATH)
+df, opts = load_and_preprocess_data(CSV_PATH)
 
 # Check if data loading was successful
 if df.empty:
     st.error("No se pudieron cargar los datos o el DataFrame está vacío después del preprocesamiento.")
     st.stop()
 
+# Filter and plot columns as flat code arrays (built once per load)
+arrays, dtypes = load_code_arrays(CSV_PATH)
+
 # --- Sidebar Filters (Optional but Recommended) ---
 st.sidebar.header("Filtros del Dashboard")
 
 # Example Filter: Filter by Gender
-unique_genders = df['Género'].unique().tolist()
+unique_genders = opts['Género']
 selected_genders = st.sidebar.multiselect(
     "Filtrar por Género del Propietario",
     options=unique_genders,
@@ -183,20 +363,18 @@ selected_genders = st.sidebar.multiselect(
 )
 
 # Example Filter: Filter by Industry
-unique_industries = df['Industria_Label'].unique().tolist()
+unique_industries = opts['Industria_Label']
 selected_industries = st.sidebar.multiselect(
     "Filtrar por Industria",
     options=unique_industries,
     default=unique_industries
 )
 
-# Apply filters
-df_filtered = df[
-    (df['Género'].isin(selected_genders)) &
-    (df['Industria_Label'].isin(selected_industries))
-]
+# Apply filters and compute the weighted percentages for every plot together, once per filter selection
+# (sorted tuples so the same selection always hits the same cache entry)
+n_registros, aggregations = compute_aggregations(tuple(sorted(selected_genders)), tuple(sorted(selected_industries)), arrays, dtypes)
 
-if df_filtered.empty:
+if n_registros == 0:
     st.warning("No hay datos que coincidan con los filtros seleccionados.")
     st.stop()
 
@@ -204,22 +382,13 @@ if df_filtered.empty:
 # --- Dashboard Pages/Sections ---
 
 st.header("Análisis General")
-st.write(f"**Número total de registros (después de duplicados y filtros):** {len(df_filtered):,}")
+st.write(f"**Número total de registros (después de duplicados y filtros):** {n_registros:,}")
 
 # --- Plot 1: Industria (GRUPOS12) ---
 st.subheader("Distribución de Negocios por Industria")
-df_industria = prepare_data_for_plotly(df_filtered, 'Industria_Label')
+df_industria = aggregations['Industria_Label']
 if not df_industria.empty:
-    fig_industria = px.bar(
-        df_industria,
-        x='Industria_Label',
-        y='Porcentaje',
-        title='Porcentaje de Negocios por Industria',
-        labels={'Industria_Label': 'Grupo de Industria', 'Porcentaje': 'Porcentaje de Negocios'},
-        hover_data={'F_EXP_Sum': True, 'Porcentaje': ':.2f'} # Show weighted count and percentage on hover
-    )
-    fig_industria.update_layout(xaxis={'categoryorder':'total descending'}, showlegend=False)
-    fig_industria.update_yaxes(rangemode="tozero", tickformat=".2f%")
+    fig_industria = build_bar(df_industria, 'Industria_Label', 'Porcentaje de Negocios por Industria', 'Grupo de Industria', 'Porcentaje de Negocios', categoryorder='total descending')
     st.plotly_chart(fig_industria, use_container_width=True)
 else:
     st.info("No hay datos para mostrar el gráfico de Industria con los filtros actuales.")
@@ -231,35 +400,17 @@ st.subheader("Análisis Demográfico de Propietarios")
 col1, col2 = st.columns(2)
 
 with col1:
-    df_genero = prepare_data_for_plotly(df_filtered, 'Género')
+    df_genero = aggregations['Género']
     if not df_genero.empty:
-        fig_genero = px.bar(
-            df_genero,
-            x='Género',
-            y='Porcentaje',
-            title='Porcentaje de Propietarios por Género',
-            labels={'Género': 'Género', 'Porcentaje': 'Porcentaje de Propietarios'},
-            hover_data={'F_EXP_Sum': True, 'Porcentaje': ':.2f'}
-        )
-        fig_genero.update_yaxes(rangemode="tozero", tickformat=".2f%")
-        fig_genero.update_layout(showlegend=False)
+        fig_genero = build_bar(df_genero, 'Género', 'Porcentaje de Propietarios por Género', 'Género', 'Porcentaje de Propietarios')
         st.plotly_chart(fig_genero, use_container_width=True)
     else:
         st.info("No hay datos para mostrar el gráfico de Género con los filtros actuales.")
 
 with col2:
-    df_edad = prepare_data_for_plotly(df_filtered, 'Edad_Grupo')
+    df_edad = aggregations['Edad_Grupo']
     if not df_edad.empty:
-        fig_edad = px.bar(
-            df_edad,
-            x='Edad_Grupo',
-            y='Porcentaje',
-            title='Porcentaje de Propietarios por Edad',
-            labels={'Edad_Grupo': 'Grupo de Edad', 'Porcentaje': 'Porcentaje de Propietarios'},
-            hover_data={'F_EXP_Sum': True, 'Porcentaje': ':.2f'}
-        )
-        fig_edad.update_yaxes(rangemode="tozero", tickformat=".2f%")
-        fig_edad.update_layout(xaxis={'categoryorder':'array', 'categoryarray':df_edad['Edad_Grupo'].tolist()}, showlegend=False) # Keep original order
+        fig_edad = build_bar(df_edad, 'Edad_Grupo', 'Porcentaje de Propietarios por Edad', 'Grupo de Edad', 'Porcentaje de Propietarios') # Already sorted in category order
         st.plotly_chart(fig_edad, use_container_width=True)
     else:
         st.info("No hay datos para mostrar el gráfico de Edad con los filtros actuales.")
@@ -271,35 +422,17 @@ st.subheader("Características del Negocio")
 col3, col4 = st.columns(2)
 
 with col3:
-    df_antiguedad = prepare_data_for_plotly(df_filtered, 'Antiguedad_Negocio_Grupo')
+    df_antiguedad = aggregations['Antiguedad_Negocio_Grupo']
     if not df_antiguedad.empty:
-        fig_antiguedad = px.bar(
-            df_antiguedad,
-            x='Antiguedad_Negocio_Grupo',
-            y='Porcentaje',
-            title='Porcentaje de Negocios por Antigüedad',
-            labels={'Antiguedad_Negocio_Grupo': 'Antigüedad (Años)', 'Porcentaje': 'Porcentaje de Negocios'},
-            hover_data={'F_EXP_Sum': True, 'Porcentaje': ':.2f'}
-        )
-        fig_antiguedad.update_yaxes(rangemode="tozero", tickformat=".2f%")
-        fig_antiguedad.update_layout(xaxis={'categoryorder':'array', 'categoryarray':df_antiguedad['Antiguedad_Negocio_Grupo'].tolist()}, showlegend=False) # Keep original order
+        fig_antiguedad = build_bar(df_antiguedad, 'Antiguedad_Negocio_Grupo', 'Porcentaje de Negocios por Antigüedad', 'Antigüedad (Años)', 'Porcentaje de Negocios') # Already sorted in category order
         st.plotly_chart(fig_antiguedad, use_container_width=True)
     else:
         st.info("No hay datos para mostrar el gráfico de Antigüedad del Negocio con los filtros actuales.")
 
 with col4:
-    df_ayuda = prepare_data_for_plotly(df_filtered, 'Tiene_Ayuda')
+    df_ayuda = aggregations['Tiene_Ayuda']
     if not df_ayuda.empty:
-        fig_ayuda = px.bar(
-            df_ayuda,
-            x='Tiene_Ayuda',
-            y='Porcentaje',
-            title='Porcentaje de Negocios con Personal de Ayuda',
-            labels={'Tiene_Ayuda': '¿Tiene Personal de Ayuda?', 'Porcentaje': 'Porcentaje de Negocios'},
-            hover_data={'F_EXP_Sum': True, 'Porcentaje': ':.2f'}
-        )
-        fig_ayuda.update_yaxes(rangemode="tozero", tickformat=".2f%")
-        fig_ayuda.update_layout(showlegend=False)
+        fig_ayuda = build_bar(df_ayuda, 'Tiene_Ayuda', 'Porcentaje de Negocios con Personal de Ayuda', '¿Tiene Personal de Ayuda?', 'Porcentaje de Negocios')
         st.plotly_chart(fig_ayuda, use_container_width=True)
     else:
         st.info("No hay datos para mostrar el gráfico de Personal de Ayuda con los filtros actuales.")
@@ -311,35 +444,17 @@ st.subheader("Ubicación Geográfica de Negocios")
 col5, col6 = st.columns(2)
 
 with col5:
-    df_area = prepare_data_for_plotly(df_filtered, 'AREA_Label')
+    df_area = aggregations['AREA_Label']
     if not df_area.empty:
-        fig_area = px.bar(
-            df_area,
-            x='AREA_Label',
-            y='Porcentaje',
-            title='Porcentaje de Negocios por Área Geográfica',
-            labels={'AREA_Label': 'Área Geográfica', 'Porcentaje': 'Porcentaje de Negocios'},
-            hover_data={'F_EXP_Sum': True, 'Porcentaje': ':.2f'}
-        )
-        fig_area.update_yaxes(rangemode="tozero", tickformat=".2f%")
-        fig_area.update_layout(showlegend=False)
+        fig_area = build_bar(df_area, 'AREA_Label', 'Porcentaje de Negocios por Área Geográfica', 'Área Geográfica', 'Porcentaje de Negocios')
         st.plotly_chart(fig_area, use_container_width=True)
     else:
         st.info("No hay datos para mostrar el gráfico de Área Geográfica con los filtros actuales.")
 
 with col6:
-    df_clase_te = prepare_data_for_plotly(df_filtered, 'CLASE_TE_Label')
+    df_clase_te = aggregations['CLASE_TE_Label']
     if not df_clase_te.empty:
-        fig_clase_te = px.bar(
-            df_clase_te,
-            x='CLASE_TE_Label',
-            y='Porcentaje',
-            title='Porcentaje de Negocios por Entorno',
-            labels={'CLASE_TE_Label': 'Entorno (Urbana/Rural)', 'Porcentaje': 'Porcentaje de Negocios'},
-            hover_data={'F_EXP_Sum': True, 'Porcentaje': ':.2f'}
-        )
-        fig_clase_te.update_yaxes(rangemode="tozero", tickformat=".2f%")
-        fig_clase_te.update_layout(showlegend=False)
+        fig_clase_te = build_bar(df_clase_te, 'CLASE_TE_Label', 'Porcentaje de Negocios por Entorno', 'Entorno (Urbana/Rural)', 'Porcentaje de Negocios')
         st.plotly_chart(fig_clase_te, use_container_width=True)
     else:
         st.info("No hay datos para mostrar el gráfico de Entorno (Urbana/Rural) con los filtros actuales.")
@@ -0,0 +1,69 @@
+import csv
+import statistics
+import numpy as np
+import pandas as pd
+import os
+import tempfile
+
+# --- Helpers shared by the Micronegocios dashboards ---
+def sniff_separator(csv_file_path, sample_size=65536):
+    """Detects the CSV separator (',' or ';') from a small sample of the file."""
+    with open(csv_file_path, 'rb') as f:
+        sample = f.read(sample_size).decode('latin-1')
+    # Drop the last line, it is usually cut in half by the sample size
+    lines = sample.splitlines()[:-1] or sample.splitlines()
+
+    try:
+        return csv.Sniffer().sniff('\n'.join(lines), delimiters=',;').delimiter
+    except csv.Error:
+        # Fallback: pick the separator with the most consistent count per line
+        counts = {sep: [line.count(sep) for line in lines] for sep in (',', ';')}
+        candidates = [sep for sep, c in counts.items() if c and min(c) > 0]
+        if not candidates:
+            return ','
+        return min(candidates, key=lambda sep: statistics.pvariance(counts[sep]))
+
+def codes_to_cat(series, labels, ordered=False):
+    """Maps 1-based survey codes to a Categorical of labels; missing or unknown codes become 'Desconocido'."""
+    codes = series.to_numpy(dtype='float64', na_value=np.nan)
+    valid = np.isin(codes, np.arange(1, len(labels) + 1))
+    out_codes = np.where(valid, codes - 1, len(labels)).astype('int8')
+    return pd.Categorical.from_codes(out_codes, categories=labels + ['Desconocido'], ordered=ordered)
+
+def filter_options(dataframe, col):
+    """Returns the sidebar options of a column, read from the categories when the column is Categorical."""
+    if isinstance(dataframe[col].dtype, pd.CategoricalDtype):
+        return dataframe[col].cat.categories.tolist()
+    return sorted(dataframe[col].dropna().unique().tolist())
+
+# --- Preprocessed Parquet copy of a CSV ---
+def read_parquet_cache(csv_file_path, script_path):
+    """Returns the preprocessed Parquet copy of the CSV, or None when it is missing, unreadable or older than the CSV, the calling script or this module."""
+    cache_path = csv_file_path + '.parquet'
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= max(os.path.getmtime(csv_file_path), os.path.getmtime(script_path), os.path.getmtime(__file__)):
+        try:
+            return pd.read_parquet(cache_path)
+        except (OSError, ValueError):
+            # A damaged copy (e.g. left by an older interrupted write) is dropped and rebuilt from the CSV
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+    return None
+
+def write_parquet_cache(df, csv_file_path, warn):
+    """Saves the preprocessed frame next to the CSV so the next cold start skips the CSV parser; failures are reported through warn."""
+    cache_path = csv_file_path + '.parquet'
+    # Write to a temporary file in the same directory and swap it in with os.replace, so an
+    # interrupted or failed write never leaves a partial copy under the cache name
+    try:
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(cache_path) + '.', suffix='.tmp.parquet', dir=os.path.dirname(cache_path) or '.')
+        os.close(fd)
+        try:
+            df.to_parquet(tmp_path, compression='zstd')
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    except (OSError, ImportError) as e:
+        warn(f"No se pudo guardar la caché Parquet de los datos: {e}")